@@ -1,15 +1,16 @@
 import websocket
 import uuid
-import json
-import urllib.request
+import orjson
 import urllib.parse
 import requests
 import os
 import time
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import base64
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from requests_toolbelt.multipart.encoder import MultipartEncoder
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -19,6 +20,8 @@ load_dotenv()
 # =================================================================================
 
 SERVER_ADDRESS = os.getenv("COMFY_HOST", "194.68.245.69:22040") 
+# Comma-separated ComfyUI servers for parallel clips; each call below takes one of these as `server`
+SERVER_ADDRESSES = [s.strip() for s in os.getenv("COMFY_BACKENDS", SERVER_ADDRESS).split(",") if s.strip()]
 USE_SECURE = False
 COMFY_AUTH = None 
 
@@ -37,49 +40,53 @@ def get_auth_header():
 
 def create_retry_session():
     session = requests.Session()
+    # Connection resets (errno 104 / WinError 10054) are retried as connect/read errors, not statuses
     retries = Retry(
         total=5,
-        backoff_factor=1,
-        status_forcelist=[500, 502, 503, 504, 104, 10054],
+        backoff_factor=0.5,
+        status_forcelist=[500, 502, 503, 504],
         allowed_methods=["POST", "GET"]
     )
-    adapter = HTTPAdapter(max_retries=retries)
+    # One cached host pool per configured backend
+    adapter = HTTPAdapter(pool_connections=max(4, len(SERVER_ADDRESSES)), pool_maxsize=8, max_retries=retries)
     session.mount("http://", adapter)
     session.mount("https://", adapter)
     return session
 
-def queue_prompt(prompt, client_id):
-    print(f"=== SENDING PROMPT TO {SERVER_ADDRESS} ===", flush=True)
+# Shared across uploads so keep-alive connections are pooled instead of re-handshaked per call
+_SESSION = create_retry_session()
+
+def queue_prompt(prompt, client_id, server=None):
+    server = server or SERVER_ADDRESS
+    print(f"=== SENDING PROMPT TO {server} ===", flush=True)
     p = {"prompt": prompt, "client_id": client_id}
-    data = json.dumps(p).encode("utf-8")
+    data = orjson.dumps(p)
     
     headers = {"Content-Type": "application/json"}
     headers.update(get_auth_header())
-    headers["Connection"] = "close"
 
-    url = f"{HTTP_PROTO}://{SERVER_ADDRESS}/prompt"
+    url = f"{HTTP_PROTO}://{server}/prompt"
     
-    for attempt in range(3):
-        try:
-            req = urllib.request.Request(url, data=data, headers=headers)
-            with urllib.request.urlopen(req, timeout=15) as response: # Added Timeout
-                result = json.loads(response.read())
-                print("✅ ComfyUI accepted prompt. ID:", result.get("prompt_id"), flush=True)
-                return result
-        except Exception as e:
-            print(f"⚠️ Queue attempt {attempt+1} failed: {e}", flush=True)
-            time.sleep(2)
+    # Transient failures are retried by the session's mounted adapter
+    try:
+        response = _SESSION.post(url, data=data, headers=headers, timeout=15)
+        response.raise_for_status()
+        result = orjson.loads(response.content)
+        print("✅ ComfyUI accepted prompt. ID:", result.get("prompt_id"), flush=True)
+        return result
+    except Exception as e:
+        print(f"⚠️ Queue attempt failed: {e}", flush=True)
             
-    raise RuntimeError("Failed to queue prompt after 3 attempts.")
+    raise RuntimeError("Failed to queue prompt after retries.")
 
-def upload_file(file_path, subfolder="", overwrite=True):
+def upload_file(file_path, subfolder="", overwrite=True, server=None):
     print(f"[UPLOAD] Sending {file_path}...", flush=True)
     
     if not os.path.exists(file_path):
         print(f"❌ File not found: {file_path}", flush=True)
         return None
 
-    session = create_retry_session()
+    session = _SESSION
     
     try:
         with open(file_path, "rb") as f:
@@ -89,16 +96,19 @@ def upload_file(file_path, subfolder="", overwrite=True):
             else:
                 content_type = f"image/{ext[1:]}"
             
-            files = {"image": (Path(file_path).name, f, content_type)}
-            data = {"subfolder": subfolder, "overwrite": str(overwrite).lower()}
+            # Streamed from disk in chunks rather than building the whole multipart body in memory
+            encoder = MultipartEncoder(fields={
+                "image": (Path(file_path).name, f, content_type),
+                "subfolder": subfolder,
+                "overwrite": str(overwrite).lower(),
+            })
             
             headers = get_auth_header()
-            headers["Connection"] = "close"
+            headers["Content-Type"] = encoder.content_type
 
             response = session.post(
-                f"{HTTP_PROTO}://{SERVER_ADDRESS}/upload/image",
-                files=files,
-                data=data,
+                f"{HTTP_PROTO}://{server or SERVER_ADDRESS}/upload/image",
+                data=encoder,
                 headers=headers,
                 timeout=600 
             )
@@ -108,16 +118,15 @@ def upload_file(file_path, subfolder="", overwrite=True):
             print(f"   -> Failed: {response.text}", flush=True)
             return None
             
-        return response.json()
+        return orjson.loads(response.content)
     except Exception as e:
         print(f"❌ Upload failed: {e}", flush=True)
         return None
-    finally:
-        session.close()
 
-def connect_websocket(client_id):
-    print(f"🔌 Connecting to WebSocket {WS_PROTO}://{SERVER_ADDRESS}...", flush=True)
-    ws_url = f"{WS_PROTO}://{SERVER_ADDRESS}/ws?clientId={client_id}"
+def connect_websocket(client_id, server=None):
+    server = server or SERVER_ADDRESS
+    print(f"🔌 Connecting to WebSocket {WS_PROTO}://{server}...", flush=True)
+    ws_url = f"{WS_PROTO}://{server}/ws?clientId={client_id}"
     
     ws = websocket.WebSocket()
     try:
@@ -129,48 +138,63 @@ def connect_websocket(client_id):
         print(f"❌ WebSocket connection failed: {e}", flush=True)
         return None 
 
-def track_progress(ws, prompt_id):
-    if not ws: return False
+def track_progress(ws, prompt_id, server=None):
+    if not ws: return None
     print(f"⏳ Tracking progress for {prompt_id}...", flush=True)
+    start_time = time.time()
     
+    # Collected per node from "executed" events; same shape as history[prompt_id]["outputs"]
+    outputs = {}
     while True:
         try:
             out = ws.recv()
-            if isinstance(out, str):
-                message = json.loads(out)
+            # Only executing/executed frames matter; skip decoding the progress/status chatter
+            if isinstance(out, str) and ('"executing"' in out or '"executed"' in out):
+                message = orjson.loads(out)
                 msg_type = message.get("type")
                 
-                if msg_type == "executing":
+                if msg_type == "executed":
+                    data = message["data"]
+                    if data.get("prompt_id") == prompt_id and data.get("output"):
+                        outputs[data["node"]] = data["output"]
+                elif msg_type == "executing":
                     data = message["data"]
                     if data["node"] is None and data["prompt_id"] == prompt_id:
                         print("✅ Execution complete (WebSocket confirmed).", flush=True)
-                        return True
+                        return outputs
         except websocket.WebSocketTimeoutException:
+            # A prompt queued behind another one is silent too; keep listening while history doesn't have it yet
+            try: finished = prompt_id in get_history(prompt_id, server)
+            except Exception: finished = True
+            if not finished and time.time() - start_time < 1500: continue
             # Drop the silent WS and let the HTTP poller take over
             print("   [WS] Timeout waiting for message, falling back to HTTP polling...", flush=True)
             break
         except Exception as e:
             print(f"❌ WS Disconnected (Network): {e}", flush=True)
+            ws.close()
             break
             
-    return False
+    return None
 
-def get_history(prompt_id):
-    url = f"{HTTP_PROTO}://{SERVER_ADDRESS}/history/{prompt_id}"
-    req = urllib.request.Request(url, headers=get_auth_header())
-    with urllib.request.urlopen(req, timeout=15) as response: # <--- CRITICAL FIX
-        return json.loads(response.read())
+def get_history(prompt_id, server=None):
+    url = f"{HTTP_PROTO}://{server or SERVER_ADDRESS}/history/{prompt_id}"
+    response = _SESSION.get(url, headers=get_auth_header(), timeout=15)
+    response.raise_for_status()
+    return orjson.loads(response.content)
 
-def wait_for_completion(prompt_id):
+def wait_for_completion(prompt_id, server=None):
     print(f"🔍 Polling history for confirmation of {prompt_id}...", flush=True)
     start_time = time.time()
+    # Short jobs are picked up within a fraction of a second; long ones settle at the old 5s rate
+    delay = 0.25
     
     while True:
         if time.time() - start_time > 1500: 
             raise RuntimeError("Timed out waiting for ComfyUI generation.")
 
         try:
-            history = get_history(prompt_id)
+            history = get_history(prompt_id, server)
             if prompt_id in history:
                 outputs = history[prompt_id].get('outputs', {})
                 if outputs:
@@ -180,25 +204,43 @@ def wait_for_completion(prompt_id):
         except Exception as e:
             print(f"   (polling error: {e}) - Retrying...", flush=True)
         
-        time.sleep(5) 
+        time.sleep(delay)
+        delay = min(delay * 1.5, 5.0)
+
+def fetch_output(filename, subfolder="", folder_type="output", server=None):
+    # Streamed over the pooled session so repeated downloads reuse the keep-alive connection
+    url = f"{HTTP_PROTO}://{server or SERVER_ADDRESS}/view"
+    params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+    return _SESSION.get(url, params=params, headers=get_auth_header(), stream=True, timeout=(3, 30))
+
+# Read once at import; each clip parses its own fresh copy from the cached bytes
+_WORKFLOW_TEMPLATE_BYTES = (BASE_DIR / "workflow_template.json").read_bytes()
 
 def load_workflow_template():
-    workflow_path = BASE_DIR / "workflow_template.json"
-    with open(workflow_path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return orjson.loads(_WORKFLOW_TEMPLATE_BYTES)
+
+def generate_clip(source_video_path, character_image_path, mask_path, output_filename, video_id=None, seed=None, mask_points=None, ws=None, client_id=None, server=None, image_name=None):
+    # A caller-owned socket (and its client_id) is reused across clips; otherwise open one per prompt.
+    # Everything for one clip goes to the same server, since uploads land in that server's input folder;
+    # image_name is a character image the caller already uploaded there
+    owns_ws = ws is None
+    current_client_id = str(uuid.uuid4()) if owns_ws else client_id
 
-def generate_clip(source_video_path, character_image_path, mask_path, output_filename, video_id=None, seed=None, mask_points=None):
-    current_client_id = str(uuid.uuid4())
+    # Both uploads are independent, so overlap them on the pooled session
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        vid_future = ex.submit(upload_file, source_video_path, server=server)
+        img_future = None if image_name else ex.submit(upload_file, character_image_path, server=server)
+        vid_resp = vid_future.result()
+        img_resp = img_future.result() if img_future else {"name": image_name}
 
-    vid_resp = upload_file(source_video_path)
     if not vid_resp: raise RuntimeError("Video upload failed")
     vid_name = vid_resp["name"]
 
-    img_resp = upload_file(character_image_path)
     if not img_resp: raise RuntimeError("Image upload failed")
     img_name = img_resp["name"]
 
     workflow = load_workflow_template()
+    nodes = {k: workflow[k]["inputs"] for k in ("3", "76", "77", "78", "79", "83", "114", "117", "119") if k in workflow}
     
     if video_id in ["Video1", "Video3"]:
         width, height = 832, 480
@@ -207,34 +249,39 @@ def generate_clip(source_video_path, character_image_path, mask_path, output_fil
     else:
         width, height = 832, 480
         
-    workflow["83"]["inputs"]["value"] = width
-    workflow["76"]["inputs"]["value"] = height
+    nodes["83"]["value"] = width
+    nodes["76"]["value"] = height
 
     if mask_points:
-        workflow["77"]["inputs"]["points_store"] = json.dumps(mask_points)
-        workflow["77"]["inputs"]["coordinates"] = json.dumps(mask_points.get("positive", []))
-        workflow["77"]["inputs"]["neg_coordinates"] = json.dumps(mask_points.get("negative", []))
+        pos = mask_points.get("positive", [])
+        neg = mask_points.get("negative", [])
+        nodes["77"]["points_store"] = orjson.dumps(mask_points).decode()
+        nodes["77"]["coordinates"] = orjson.dumps(pos).decode() if pos else "[]"
+        nodes["77"]["neg_coordinates"] = orjson.dumps(neg).decode() if neg else "[]"
 
-    workflow["79"]["inputs"]["video"] = vid_name
-    if "119" in workflow: workflow["119"]["inputs"]["video"] = vid_name
-    elif "117" in workflow: workflow["117"]["inputs"]["video"] = vid_name
+    nodes["79"]["video"] = vid_name
+    if "119" in nodes: nodes["119"]["video"] = vid_name
+    elif "117" in nodes: nodes["117"]["video"] = vid_name
         
-    workflow["78"]["inputs"]["image"] = img_name
-    workflow["114"]["inputs"]["filename_prefix"] = output_filename
+    nodes["78"]["image"] = img_name
+    nodes["114"]["filename_prefix"] = output_filename
     
-    if seed: workflow["3"]["inputs"]["seed"] = seed
-    else: workflow["3"]["inputs"]["seed"] = int(time.time() * 1000) % 10000000000
+    if seed: nodes["3"]["seed"] = seed
+    else: nodes["3"]["seed"] = int(time.time() * 1000) % 10000000000
 
-    prompt_response = queue_prompt(workflow, current_client_id)
+    prompt_response = queue_prompt(workflow, current_client_id, server)
     prompt_id = prompt_response["prompt_id"]
     
-    ws = connect_websocket(current_client_id)
+    if owns_ws: ws = connect_websocket(current_client_id, server)
+    outputs = None
     if ws:
-        track_progress(ws, prompt_id)
-        ws.close()
+        outputs = track_progress(ws, prompt_id, server)
+        if owns_ws: ws.close()
     
-    history = wait_for_completion(prompt_id)
-    outputs = history.get(prompt_id, {}).get('outputs', {})
+    # Cached nodes emit no "executed" event, so an empty result also goes to history
+    if not outputs:
+        history = wait_for_completion(prompt_id, server)
+        outputs = history.get(prompt_id, {}).get('outputs', {})
     
     print(f"[DEBUG] Validating outputs against prefix: '{output_filename}'", flush=True)
     
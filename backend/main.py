@@ -1,23 +1,35 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Security, Depends
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Security, Depends, Header, Response
 from fastapi.security import APIKeyHeader
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
 from fastapi import UploadFile, File
 from starlette.status import HTTP_403_FORBIDDEN
+from starlette.formparsers import MultiPartParser
 from pydantic import BaseModel, Field
 from pathlib import Path
 from dotenv import load_dotenv
 from typing import Optional, Dict, List
-import json
+from functools import lru_cache
+from fractions import Fraction
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+import aiofiles
 import shutil
 import os
 import threading
 import queue
 import comfy_client
 import traceback
-import requests
 import subprocess
 import time
+import uuid
+import asyncio
+import anyio
+import tempfile
+import zlib
 
 load_dotenv()
 app = FastAPI()
@@ -40,13 +52,15 @@ else:
 for d in [OUTPUTS_DIR, ASSETS_DIR]:
     d.mkdir(parents=True, exist_ok=True)
 
-# Automatically copy default assets from your GitHub repo to the /tmp folder on startup
+# Automatically link default assets from your GitHub repo into the /tmp folder on startup
+# (symlinks move no bytes; copy only where the filesystem refuses them)
 if IS_CLOUD:
     repo_assets = REPO_ROOT / "assets"
     if repo_assets.exists():
         for item in repo_assets.iterdir():
-            if item.is_file() and not (ASSETS_DIR / item.name).exists():
-                shutil.copy2(item, ASSETS_DIR / item.name)
+            if item.is_file() and not os.path.lexists(ASSETS_DIR / item.name):
+                try: os.symlink(item, ASSETS_DIR / item.name)
+                except OSError: shutil.copyfile(item, ASSETS_DIR / item.name)
 
 print(f"==== BACKEND STARTED ({'CLOUD' if IS_CLOUD else 'LOCAL'}) ====", flush=True)
 
@@ -54,17 +68,22 @@ print(f"==== BACKEND STARTED ({'CLOUD' if IS_CLOUD else 'LOCAL'}) ====", flush=T
 API_KEY_NAME = "X-Access-Token"
 api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=False)
 
+# Keyed by the raw env value, so a changed ALLOWED_KEYS is still picked up
+@lru_cache(maxsize=1)
+def parse_allowed_keys(raw: str) -> frozenset: return frozenset(key for key in raw.split(",") if key)
+
 def get_api_key(api_key_header: str = Security(api_key_header)):
     if not IS_CLOUD: return "dev-mode"
-    allowed_keys = os.getenv("ALLOWED_KEYS", "").split(",")
-    if api_key_header in allowed_keys: return api_key_header
+    if api_key_header in parse_allowed_keys(os.getenv("ALLOWED_KEYS", "")): return api_key_header
     raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail="Invalid Access Token")
 
 # --- 3. CORS & STATIC ---
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
 app.mount("/inputs", StaticFiles(directory=INPUTS_DIR), name="inputs")
 app.mount("/outputs", StaticFiles(directory=OUTPUTS_DIR), name="outputs")
-app.mount("/assets", StaticFiles(directory=ASSETS_DIR), name="assets")
+# Cloud assets are symlinks into the repo, which StaticFiles would otherwise refuse as outside its directory
+app.mount("/assets", StaticFiles(directory=ASSETS_DIR, follow_symlink=True), name="assets")
 
 # --- 4. MODELS ---
 class ClipAction(BaseModel):
@@ -82,210 +101,631 @@ class ClipInfo(BaseModel):
     mask_points: Optional[Dict] = None
 
 # --- 5. JOB QUEUE ---
-JOB_QUEUE = queue.Queue()
-stop_event = threading.Event()
+# One queue per worker, sharded by video_id so a project's jobs keep their order on a single worker
+JOB_WORKERS = max(1, int(os.getenv("JOB_WORKERS", "1")))
+JOB_QUEUES = [asyncio.Queue() for _ in range(JOB_WORKERS)]
+# Clips in flight against ComfyUI at once (one per configured backend by default, since a single server
+# runs prompts one at a time anyway); passes within a clip always stay sequential
+CLIP_CONCURRENCY = max(1, int(os.getenv("COMFY_PAR", str(len(comfy_client.SERVER_ADDRESSES)))))
+# One stop event per running job, so a job starting on one worker can't clear a /stop meant for another
+job_stops = set()
 processing_status = {
-    "is_processing": False, "current_clip": None, 
-    "current_pass": 0, "queue_size": 0, "last_completed": None
+    "is_processing": False, "active_clips": {},
+    "queue_size": 0, "last_completed": None
 }
-
-def worker_loop():
-    print("[WORKER] Thread started...", flush=True)
+active_jobs = 0
+
+def snapshot_status():
+    body = orjson.dumps(processing_status)
+    return body, f'"{zlib.crc32(body):08x}"'
+
+# Serialized body + ETag, rebuilt on each change and swapped in as one tuple so /status only reads a reference
+status_snapshot = snapshot_status()
+status_lock = threading.RLock()
+
+def set_status(**changes):
+    global status_snapshot
+    # The lock only orders writers, so a slower thread can't publish an older snapshot over a newer one
+    with status_lock:
+        processing_status.update(changes)
+        status_snapshot = snapshot_status()
+
+def set_clip_pass(video_id: str, clip_id: str, pass_num: Optional[int] = None):
+    # active_clips maps video_id -> {clip_id: current pass} for every clip in flight; None drops the clip.
+    # Rebuilt rather than edited in place, so dicts already handed out are never changed under a reader
+    with status_lock:
+        active = {vid: dict(clips) for vid, clips in processing_status["active_clips"].items()}
+        clips = active.setdefault(video_id, {})
+        if pass_num is None: clips.pop(clip_id, None)
+        else: clips[clip_id] = pass_num
+        if not clips: del active[video_id]
+        set_status(active_clips=active)
+
+def queued_jobs() -> int: return sum(q.qsize() for q in JOB_QUEUES)
+
+def enqueue_job(video_id: str, clip_ids: List[str]):
+    JOB_QUEUES[hash(video_id) % JOB_WORKERS].put_nowait((video_id, clip_ids))
+    set_status(queue_size=queued_jobs())
+
+async def worker_loop(job_queue: asyncio.Queue):
+    global active_jobs
+    print("[WORKER] Task started...", flush=True)
     while True:
-        task = JOB_QUEUE.get()
+        task = await job_queue.get()
         if task is None: break
         video_id, clip_ids = task
+        # Counted on the event loop, so is_processing stays set until the last concurrent job ends
+        active_jobs += 1
+        # Registered on the event loop before the job starts, so a /stop can never slip in between
+        job_stop = threading.Event()
+        job_stops.add(job_stop)
         try:
-            processing_status["queue_size"] = JOB_QUEUE.qsize()
-            run_queue_processor(video_id, clip_ids)
+            set_status(is_processing=True, queue_size=queued_jobs())
+            # The processor does blocking HTTP, WebSocket and file work, so it runs off the event loop
+            await asyncio.to_thread(run_queue_processor, video_id, clip_ids, job_stop)
         except Exception as e:
             print(f"[WORKER ERROR] {e}", flush=True)
             traceback.print_exc()
         finally:
-            JOB_QUEUE.task_done()
-            processing_status["queue_size"] = JOB_QUEUE.qsize()
+            job_stops.discard(job_stop)
+            active_jobs -= 1
+            job_queue.task_done()
+            set_status(is_processing=active_jobs > 0, queue_size=queued_jobs())
 
 @app.on_event("startup")
-def startup_event():
-    t = threading.Thread(target=worker_loop, daemon=True)
-    t.start()
+async def startup_event():
+    app.state.workers = [asyncio.create_task(worker_loop(q)) for q in JOB_QUEUES]
 
 # --- 6. HELPERS ---
+def ensure_dir(path: Path) -> Path:
+    # Not memoized: /tmp cleanup on the cloud host or a deleted masks/outputs folder must be recreated,
+    # and an existing directory only costs a mkdir that fails with EEXIST
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
 def get_job_profile_path(video_id: str) -> Path:
     path = INPUTS_DIR / video_id / f"{video_id}.job.json"
     if not path.exists(): path = INPUTS_DIR / f"{video_id}.job.json"
     return path
 
-def get_mask_path(video_id: str, clip_id: str, pass_num: int) -> Path:
-    # FIX: Point to persistent inputs directory instead of temporary outputs
-    mask_dir = INPUTS_DIR / video_id / "masks"
-    mask_dir.mkdir(parents=True, exist_ok=True)
-    return mask_dir / f"{clip_id}_pass{pass_num}.json"
+@lru_cache(maxsize=64)
+def load_job_profile(path_str: str, mtime_ns: int, size: int) -> Dict:
+    # mtime and size are part of the cache key, so an edited profile is re-read even on coarse-mtime
+    # filesystems (FAT/exFAT, some network shares); callers must not mutate the result
+    with open(path_str, "rb") as f: return orjson.loads(f.read())
 
-def move_comfy_output(remote_filename: str, dest_path: Path) -> bool:
-    from comfy_client import SERVER_ADDRESS, HTTP_PROTO, get_auth_header
-    url = f"{HTTP_PROTO}://{SERVER_ADDRESS}/view?filename={remote_filename}&subfolder=&type=output"
-    for attempt in range(5):
-        if stop_event.is_set(): return False
-        try:
-            r = requests.get(url, headers=get_auth_header(), stream=True, timeout=30)
-            if r.status_code == 200:
-                dest_path.parent.mkdir(parents=True, exist_ok=True)
-                with open(dest_path, 'wb') as f:
-                    for chunk in r.iter_content(chunk_size=8192): f.write(chunk)
-                return True
-        except Exception as e: pass
-        time.sleep(2)
-    return False
+@lru_cache(maxsize=64)
+def index_job_clips(path_str: str, mtime_ns: int, size: int) -> Dict[str, Dict]:
+    # Built once per profile version, alongside the cached parse it indexes
+    return {c["clip_id"]: c for c in load_job_profile(path_str, mtime_ns, size)["clips"]}
 
-# --- 7. PROCESSOR ---
-def run_queue_processor(video_id: str, clip_ids: List[str]):
-    global processing_status
-    processing_status["is_processing"] = True
-    stop_event.clear()
+def profile_cache_key(video_id: str):
+    json_path = get_job_profile_path(video_id)
+    st = json_path.stat()
+    return str(json_path), st.st_mtime_ns, st.st_size
 
-    try:
-        json_path = get_job_profile_path(video_id)
-        with open(json_path, "r") as f: job_data = json.load(f)
-        clips_map = {c["clip_id"]: c for c in job_data["clips"]}
+def read_job_profile(video_id: str) -> Dict: return load_job_profile(*profile_cache_key(video_id))
 
-        for i, clip_id in enumerate(clip_ids):
-            if stop_event.is_set(): break
-            processing_status["current_clip"] = clip_id
-            clip_info = clips_map.get(clip_id)
-            if not clip_info: continue
+def read_job_clips(video_id: str) -> Dict[str, Dict]: return index_job_clips(*profile_cache_key(video_id))
 
-            print(f"\n>>> PROCESSING: {clip_id}", flush=True)
+def get_clip_source_path(video_id: str, clip_info: Dict) -> Path:
+    if "TrimmedClips" in clip_info["path"]:
+        return INPUTS_DIR / video_id / "TrimmedClips" / Path(clip_info["path"]).name
+    return INPUTS_DIR / clip_info["path"]
 
-            if "TrimmedClips" in clip_info["path"]:
-                 clean_name = Path(clip_info["path"]).name
-                 current_source = INPUTS_DIR / video_id / "TrimmedClips" / clean_name
-            else:
-                 current_source = INPUTS_DIR / clip_info["path"]
+@lru_cache(maxsize=64)
+def get_character_image(character: str) -> Optional[Path]:
+    # Cleared by upload_character, the only place custom images change
+    names = list_assets()
+    for name in (f"custom_{character}.png", f"{character}.png"):
+        if name in names: return ASSETS_DIR / name
+    return None
 
-            original_source = current_source
-            output_dir = OUTPUTS_DIR / video_id
-            output_dir.mkdir(parents=True, exist_ok=True)
+def list_assets() -> set:
+    # One readdir answers every asset lookup in a call
+    try: return {entry.name for entry in os.scandir(ASSETS_DIR) if entry.is_file()}
+    except FileNotFoundError: return set()
 
-            actions = sorted(clip_info["actions"], key=lambda x: x["pass"])
+def get_mask_dir(video_id: str) -> Path:
+    # FIX: Point to persistent inputs directory instead of temporary outputs
+    return INPUTS_DIR / video_id / "masks"
 
-            for action in actions:
-                if stop_event.is_set(): break
-                pass_num = action["pass"]
-                processing_status["current_pass"] = pass_num
-                
-                print(f"   > Pass {pass_num} ({action['character']})", flush=True)
+def get_mask_path(video_id: str, clip_id: str, pass_num: int) -> Path:
+    mask_dir = get_mask_dir(video_id)
+    ensure_dir(mask_dir)
+    return mask_dir / f"{clip_id}_pass{pass_num}.json"
+
+COPY_BUFSIZE = 1 << 20
+
+def read_mask(mask_path: Path) -> Optional[Dict]:
+    try: return orjson.loads(mask_path.read_bytes())
+    except FileNotFoundError: return None
+
+def part_path(dest: Path) -> Path:
+    # Keeps the extension, so ffmpeg still picks the container and clear_outputs still sweeps it
+    return dest.with_name(f"{dest.stem}.part{dest.suffix}")
+
+def link_or_copy(src: Path, dest: Path):
+    # Hardlink is O(1) on the same volume; copyfile falls back to the kernel-side fast copy, renamed in whole
+    dest.unlink(missing_ok=True)
+    try: os.link(src, dest)
+    except OSError:
+        part = part_path(dest)
+        shutil.copyfile(src, part)
+        os.replace(part, dest)
+
+def sendfile_copy(src, dest: Path):
+    size = os.fstat(src.fileno()).st_size
+    with open(dest, "wb") as out:
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(out.fileno(), src.fileno(), offset, size - offset)
+            # A short copy raises so the caller rewrites the file through its buffered fallback
+            if sent == 0: raise OSError(f"sendfile stopped at {offset} of {size} bytes")
+            offset += sent
+
+def copy_upload(src, dest: Path):
+    with open(dest, "wb") as out: shutil.copyfileobj(src, out, COPY_BUFSIZE)
+
+def move_comfy_output(remote_filename: str, dest_path: Path, server: Optional[str] = None, stop: Optional[threading.Event] = None) -> bool:
+    # generate_clip returns only after ComfyUI reported the output, so there is nothing to poll for;
+    # transient connection/5xx failures are retried by the session's adapter
+    if stop and stop.is_set(): return False
+    # Written beside the destination and renamed over it, so a cut-off transfer never looks like a finished pass
+    # and a hardlinked finished clip at dest_path keeps its own inode
+    part_path = dest_path.with_name(dest_path.name + ".part")
+    try:
+        with comfy_client.fetch_output(remote_filename, server=server) as r:
+            if r.status_code != 200: return False
+            ensure_dir(dest_path.parent)
+            # Straight off the socket in 1 MiB reads; urllib3 still undoes any Content-Encoding
+            r.raw.decode_content = True
+            with open(part_path, 'wb') as f: shutil.copyfileobj(r.raw, f, COPY_BUFSIZE)
+            os.replace(part_path, dest_path)
+            return True
+    except Exception as e:
+        print(f"     [DOWNLOAD ERROR] {e}", flush=True)
+        part_path.unlink(missing_ok=True)
+        return False
+
+# profile is compared too: stream-copying segments from different H.264 encoders/profiles breaks playback
+PROBE_FIELDS = ("codec_name", "width", "height", "r_frame_rate", "pix_fmt", "sample_aspect_ratio", "profile")
+
+@lru_cache(maxsize=256)
+def probe_video(path_str: str, mtime_ns: int) -> Optional[tuple]:
+    # First video stream's PROBE_FIELDS; mtime_ns keys out entries for rewritten files
+    try: result = subprocess.run(["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", f"stream={','.join(PROBE_FIELDS)}", "-of", "json", path_str], capture_output=True)
+    except OSError: return None
+    try: stream = orjson.loads(result.stdout)["streams"][0]
+    except (orjson.JSONDecodeError, KeyError, IndexError): return None
+    return tuple(stream.get(k) for k in PROBE_FIELDS)
+
+def probe_file(path: Path) -> Optional[tuple]:
+    return probe_video(str(path), path.stat().st_mtime_ns)
+
+def probe_fps(path: Path) -> Optional[Fraction]:
+    probe = probe_file(path)
+    try: return Fraction(probe[3]) if probe else None
+    except (TypeError, ValueError, ZeroDivisionError): return None
+
+def is_normalized(probe: Optional[tuple], fps) -> bool:
+    if not probe: return False
+    codec, rate, pix_fmt = probe[0], probe[3], probe[4]
+    try: return codec == "h264" and pix_fmt == "yuv420p" and Fraction(rate) == Fraction(str(fps))
+    except (TypeError, ValueError, ZeroDivisionError): return False
+
+@lru_cache(maxsize=1)
+def h264_encoder() -> tuple:
+    # Listed encoders can still be unusable (no GPU/driver), so each candidate must survive a tiny test encode
+    for name, opts in (("h264_nvenc", ("-preset", "p4")), ("h264_videotoolbox", ())):
+        test = subprocess.run(["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "color=c=black:s=256x256:d=0.1", "-c:v", name, *opts, "-pix_fmt", "yuv420p", "-f", "null", "-"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if test.returncode == 0: return ("-c:v", name, *opts)
+    return ("-c:v", "libx264")
+
+# Segments that may be stream-copied into a concat must match ComfyUI's libx264 High output (a hardware encoder's
+# Main-profile stream never would), so only the final re-encode, which is never concatenated again, uses h264_encoder()
+CONCAT_ENCODER = ("-c:v", "libx264", "-profile:v", "high")
+
+def convert_clip(source: Path, dest: Path, fps, size: Optional[tuple] = None) -> bool:
+    # size matches the generated clips so the concat can stream-copy; encoded beside dest and renamed over it,
+    # so a failed or cut-off encode never leaves a truncated clip under the final name
+    scale = ["-vf", f"scale={size[0]}:{size[1]},setsar=1"] if size else []
+    part = part_path(dest)
+    try: result = subprocess.run(["ffmpeg", "-y", "-i", str(source), *scale, *CONCAT_ENCODER, "-pix_fmt", "yuv420p", "-r", str(fps), str(part)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except OSError: return False
+    if result.returncode == 0 and part.exists():
+        os.replace(part, dest)
+        return True
+    part.unlink(missing_ok=True)
+    return False
 
-                mask_file = get_mask_path(video_id, clip_id, pass_num)
-                mask_points = json.load(open(mask_file, "r")) if mask_file.exists() else None
+SEEK_AHEAD_FRAMES = 24
+
+class FrameExtractor:
+    """One long-lived ffmpeg per clip decoding to an MJPEG pipe, so scrubbing skips process start-up and demux init."""
+    def __init__(self, clip_file: Path, frames_dir: Path, clip_id: str):
+        self.clip_file = clip_file
+        self.frames_dir = frames_dir
+        self.clip_id = clip_id
+        self.lock = threading.Lock()
+        self.proc = None
+        self.next_index = 0
+        self.buffer = b""
+        self.fps = probe_fps(clip_file)
+
+    def frame_path(self, index: int) -> Path:
+        return self.frames_dir / f"{self.clip_id}_f{index}.jpg"
+
+    def _start(self, index: int = 0):
+        self.close()
+        # Input-side -ss seeks to the keyframe and decodes forward from there; aiming half a frame early
+        # makes the first output frame exactly `index` on a constant-rate clip
+        seek = ["-ss", f"{(index - 0.5) / self.fps:.6f}"] if index and self.fps else []
+        self.proc = subprocess.Popen(
+            ["ffmpeg", "-v", "error", *seek, "-i", str(self.clip_file), "-vsync", "0", "-f", "image2pipe", "-vcodec", "mjpeg", "-q:v", "2", "-"],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        self.next_index = index if seek else 0
+        self.buffer = b""
+
+    def _read_jpeg(self) -> Optional[bytes]:
+        # Frames are split on the JPEG end-of-image marker; 0xFF inside scan data is always byte-stuffed
+        while True:
+            end = self.buffer.find(b"\xff\xd9")
+            if end != -1:
+                jpeg, self.buffer = self.buffer[:end + 2], self.buffer[end + 2:]
+                return jpeg
+            chunk = self.proc.stdout.read1(1 << 16)
+            if not chunk: return None
+            self.buffer += chunk
+
+    def extract(self, index: int) -> bool:
+        with self.lock:
+            # Seek rather than JPEG-encode every frame in between on a long jump, or restart on a backward one
+            if self.proc is None or index < self.next_index or index - self.next_index > SEEK_AHEAD_FRAMES: self._start(index)
+            while self.next_index <= index:
+                jpeg = self._read_jpeg()
+                if jpeg is None:
+                    self.close()
+                    return False
+                # Only the requested frame is kept; it is renamed into place whole, since readers check for
+                # it outside this lock and /outputs may serve it at any moment
+                if self.next_index == index:
+                    path = self.frame_path(index)
+                    part = path.with_suffix(".part")
+                    part.write_bytes(jpeg)
+                    os.replace(part, path)
+                self.next_index += 1
+            return True
+
+    def close(self):
+        if self.proc:
+            self.proc.kill()
+            self.proc.wait()
+            self.proc = None
+
+FRAME_EXTRACTORS_MAX = 4
+frame_extractors: "OrderedDict[str, FrameExtractor]" = OrderedDict()
+frame_extractors_lock = threading.Lock()
+
+def get_frame_extractor(clip_file: Path, frames_dir: Path, clip_id: str) -> FrameExtractor:
+    key = str(clip_file)
+    with frame_extractors_lock:
+        extractor = frame_extractors.get(key)
+        if extractor:
+            frame_extractors.move_to_end(key)
+            return extractor
+        extractor = frame_extractors[key] = FrameExtractor(clip_file, frames_dir, clip_id)
+        if len(frame_extractors) > FRAME_EXTRACTORS_MAX:
+            _, idle = frame_extractors.popitem(last=False)
+            with idle.lock: idle.close()
+        return extractor
 
-                char_img = ASSETS_DIR / f"custom_{action['character']}.png"
-                if not char_img.exists():
-                    print(f"     [ERROR] Missing character image: {char_img}", flush=True)
-                    continue
+# --- 7. PROCESSOR ---
+def process_clip(video_id: str, clip_id: str, clip_info: Dict, source: Path, conn: Dict, image_name=None, stop: Optional[threading.Event] = None):
+    stop = stop or threading.Event()
+    set_clip_pass(video_id, clip_id, 0)
+    try: run_clip_passes(video_id, clip_id, clip_info, source, conn, image_name, stop)
+    finally: set_clip_pass(video_id, clip_id)
+
+def run_clip_passes(video_id: str, clip_id: str, clip_info: Dict, source: Path, conn: Dict, image_name, stop: threading.Event):
+    print(f"\n>>> PROCESSING: {clip_id}", flush=True)
+
+    current_source = source
+    original_source = current_source
+    output_dir = OUTPUTS_DIR / video_id
+    ensure_dir(output_dir)
+
+    actions = sorted(clip_info["actions"], key=lambda x: x["pass"])
+    # Read every pass's mask up front so no disk reads sit between GPU passes
+    masks = {action["pass"]: read_mask(get_mask_path(video_id, clip_id, action["pass"])) for action in actions}
+
+    # Passes stay sequential: each one feeds on the previous pass's output
+    for action in actions:
+        if stop.is_set(): break
+        pass_num = action["pass"]
+        set_clip_pass(video_id, clip_id, pass_num)
+        
+        print(f"   > Pass {pass_num} ({action['character']})", flush=True)
 
-                job_prefix = f"DF_{video_id}_{clip_id}_pass{pass_num}"
-                
-                try:
-                    real_fn = comfy_client.generate_clip(
-                        source_video_path=current_source, character_image_path=char_img,
-                        mask_path=None, output_filename=job_prefix, video_id=video_id, mask_points=mask_points
-                    )
-                    
-                    if not real_fn:
-                        print("     [ERROR] Generation failed.", flush=True)
-                        break
-
-                    temp_out = output_dir / f"{job_prefix}.mp4"
-                    if move_comfy_output(real_fn, temp_out):
-                        current_source = temp_out
-                    else:
-                        print("     [ERROR] Download failed.", flush=True)
-                        break
-                
-                except Exception as e:
-                    print(f"     [EXCEPTION] {e}", flush=True)
-                    traceback.print_exc()
-                    break
-
-            final_dest = output_dir / f"{clip_id}.mp4"
-            if current_source.exists() and current_source != original_source:
-                 shutil.copy(current_source, final_dest)
-                 print(f"   [DONE] Saved deepfake: {final_dest}", flush=True)
-                 processing_status["last_completed"] = clip_id
+        mask_points = masks[pass_num]
+
+        char_img = get_character_image(action["character"])
+        if not char_img:
+            print(f"     [ERROR] Missing character image: {action['character']}", flush=True)
+            continue
+
+        job_prefix = f"DF_{video_id}_{clip_id}_pass{pass_num}"
+        
+        try:
+            if not conn["ws"] or not conn["ws"].connected: conn["ws"] = comfy_client.connect_websocket(conn["client_id"], conn["server"])
+            real_fn = comfy_client.generate_clip(
+                source_video_path=current_source, character_image_path=char_img,
+                mask_path=None, output_filename=job_prefix, video_id=video_id, mask_points=mask_points,
+                ws=conn["ws"], client_id=conn["client_id"], server=conn["server"],
+                image_name=image_name(char_img, conn["server"]) if image_name else None
+            )
+            
+            if not real_fn:
+                print("     [ERROR] Generation failed.", flush=True)
+                break
+
+            temp_out = output_dir / f"{job_prefix}.mp4"
+            if move_comfy_output(real_fn, temp_out, conn["server"], stop):
+                current_source = temp_out
             else:
-                 print(f"   [SKIPPED] Generation failed or bypassed for: {clip_id}", flush=True)
+                print("     [ERROR] Download failed.", flush=True)
+                break
+        
+        except Exception as e:
+            print(f"     [EXCEPTION] {e}", flush=True)
+            traceback.print_exc()
+            break
+
+    final_dest = output_dir / f"{clip_id}.mp4"
+    if current_source.exists() and current_source != original_source:
+         # Re-encode only clips that would stop build_final_video from stream-copying the concat. An unreadable
+         # probe or a failed encode keeps ComfyUI's own output; the stitch re-encodes a mismatched concat anyway
+         fps = read_job_profile(video_id)["fps"]
+         probe = probe_file(current_source)
+         try:
+             if probe is None or is_normalized(probe, fps) or not convert_clip(current_source, final_dest, fps):
+                 link_or_copy(current_source, final_dest)
+         except OSError as e:
+             print(f"   [ERROR] Could not save {final_dest}: {e}", flush=True)
+             return
+         print(f"   [DONE] Saved deepfake: {final_dest}", flush=True)
+         set_status(last_completed=clip_id)
+    else:
+         print(f"   [SKIPPED] Generation failed or bypassed for: {clip_id}", flush=True)
+
+def run_queue_processor(video_id: str, clip_ids: List[str], stop: Optional[threading.Event] = None):
+    stop = stop or threading.Event()
+
+    # One client_id and socket per concurrent slot, reused across clips; track_progress filters by prompt_id
+    connections = queue.Queue()
+    # Slots are spread round-robin over the configured backends and keep their server for every clip they run
+    for slot in range(CLIP_CONCURRENCY):
+        client_id = str(uuid.uuid4())
+        server = comfy_client.SERVER_ADDRESSES[slot % len(comfy_client.SERVER_ADDRESSES)]
+        connections.put({"client_id": client_id, "server": server, "ws": comfy_client.connect_websocket(client_id, server)})
+
+    try:
+        clips_map = read_job_clips(video_id)
+        sources = {cid: get_clip_source_path(video_id, clips_map[cid]) for cid in clip_ids if cid in clips_map}
+
+        # Each character image goes to each server once per run: concurrent clips re-uploading the same
+        # name with overwrite=true could replace it while another prompt is reading it
+        uploaded, upload_lock = {}, threading.Lock()
+        def image_name(char_img: Path, server: str) -> Optional[str]:
+            with upload_lock:
+                if (char_img, server) not in uploaded:
+                    resp = comfy_client.upload_file(str(char_img), server=server)
+                    if not resp: return None
+                    uploaded[char_img, server] = resp["name"]
+                return uploaded[char_img, server]
+
+        def run_clip(clip_id: str):
+            if stop.is_set(): return
+            conn = connections.get()
+            try: process_clip(video_id, clip_id, clips_map[clip_id], sources[clip_id], conn, image_name, stop)
+            finally: connections.put(conn)
+
+        # ComfyUI serializes GPU work itself; overlapping clips hides upload/download time behind it
+        with ThreadPoolExecutor(max_workers=CLIP_CONCURRENCY) as pool:
+            list(pool.map(run_clip, [cid for cid in clip_ids if cid in clips_map]))
 
     except Exception as e:
         print(f"[QUEUE ERROR] {e}", flush=True)
     finally:
-        processing_status["is_processing"] = False
-        processing_status["current_clip"] = None
+        while not connections.empty():
+            ws = connections.get_nowait()["ws"]
+            if ws: ws.close()
 
 # --- 8. ENDPOINTS ---
 
+# Project folder name -> (folder mtime, has job.json). A folder's mtime moves whenever its job.json is added
+# or removed, so only changed folders are re-checked
+_projects_cache: Dict[str, tuple] = {}
+
 @app.get("/projects")
-def list_projects(): return [d.name for d in INPUTS_DIR.iterdir() if d.is_dir() and (d / f"{d.name}.job.json").exists()]
+def list_projects():
+    global _projects_cache
+    cached, fresh = _projects_cache, {}
+    # scandir answers is_dir from d_type, so an unchanged folder costs one stat and no job.json lookup
+    with os.scandir(INPUTS_DIR) as entries:
+        for entry in entries:
+            if not entry.is_dir(): continue
+            mtime = entry.stat().st_mtime_ns
+            hit = cached.get(entry.name)
+            fresh[entry.name] = hit if hit and hit[0] == mtime else (mtime, os.path.exists(os.path.join(entry.path, f"{entry.name}.job.json")))
+    # Built whole and swapped in with one assignment, so concurrent requests never see a half-updated cache
+    _projects_cache = fresh
+    return [name for name, (_, ready) in fresh.items() if ready]
 
 @app.get("/project/{video_id}")
 def get_project(video_id: str):
-    json_path = get_job_profile_path(video_id)
-    with open(json_path, "r") as f: data = json.load(f)
+    job_data = read_job_profile(video_id)
+    # Status is per-request, so annotate copies rather than the cached profile
+    data = {**job_data, "clips": [dict(clip) for clip in job_data["clips"]]}
     out_dir = OUTPUTS_DIR / video_id
-    for clip in data["clips"]: clip["status"] = "done" if (out_dir / f"{clip['clip_id']}.mp4").exists() else "pending"
-    return data
-
-@app.get("/frame/{video_id}/{clip_id}")
-def get_frame(video_id: str, clip_id: str, frame: int = 0):
+    # One readdir instead of a stat per clip
+    try: done = {entry.name for entry in os.scandir(out_dir) if entry.is_file()}
+    except FileNotFoundError: done = set()
+    for clip in data["clips"]: clip["status"] = "done" if f"{clip['clip_id']}.mp4" in done else "pending"
+    return Response(orjson.dumps(data), media_type="application/json")
+
+def get_frame_file(video_id: str, clip_id: str, frame: int) -> Path:
+    # Same guard as /frames: the extractor would seek negative and file frame 0 under this name
+    if frame < 0: raise HTTPException(status_code=400, detail="frame must be non-negative")
     clip_filename = f"{clip_id}.mp4"
     clip_file = INPUTS_DIR / video_id / "TrimmedClips" / clip_filename
     if not clip_file.exists(): raise HTTPException(status_code=404, detail="Source clip not found")
     temp_frame = OUTPUTS_DIR / video_id / "frames" / f"{clip_id}_f{frame}.jpg"
-    temp_frame.parent.mkdir(parents=True, exist_ok=True)
-    subprocess.run(["ffmpeg", "-y", "-i", str(clip_file), "-vf", f"select=eq(n\\,{frame})", "-vframes", "1", "-q:v", "2", str(temp_frame)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    ensure_dir(temp_frame.parent)
+    if not temp_frame.exists(): get_frame_extractor(clip_file, temp_frame.parent, clip_id).extract(frame)
+    return temp_frame
+
+# ffmpeg/filesystem-bound endpoints get their own worker slots instead of tying up FastAPI's shared threadpool
+MEDIA_LIMITER = anyio.CapacityLimiter(max(2, os.cpu_count() or 2))
+
+async def run_media(func, *args): return await anyio.to_thread.run_sync(func, *args, limiter=MEDIA_LIMITER)
+
+@app.get("/frame/{video_id}/{clip_id}")
+async def get_frame(video_id: str, clip_id: str, frame: int = 0):
+    temp_frame = await run_media(get_frame_file, video_id, clip_id, frame)
     return {"url": f"/outputs/{video_id}/frames/{temp_frame.name}"}
 
+# Serves the JPEG itself so the UI skips the JSON round trip; the ETag lets the browser revalidate with a 304
+@app.get("/frame/{video_id}/{clip_id}/image")
+async def get_frame_image(video_id: str, clip_id: str, frame: int = 0, if_none_match: Optional[str] = Header(None)):
+    clip_file = INPUTS_DIR / video_id / "TrimmedClips" / f"{clip_id}.mp4"
+    if not clip_file.exists(): raise HTTPException(status_code=404, detail="Source clip not found")
+    etag = f'"{clip_file.stat().st_mtime_ns:x}-{frame}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match == etag: return Response(status_code=304, headers=headers)
+    temp_frame = await run_media(get_frame_file, video_id, clip_id, frame)
+    if not temp_frame.exists(): raise HTTPException(status_code=404, detail="Frame not found")
+    async with aiofiles.open(temp_frame, "rb") as f: return Response(await f.read(), media_type="image/jpeg", headers=headers)
+
+@app.get("/frames/{video_id}/{clip_id}")
+def get_frames(video_id: str, clip_id: str, frames: str = "0"):
+    try: indices = sorted({int(f) for f in frames.split(",") if f.strip()})
+    except ValueError: raise HTTPException(status_code=400, detail="frames must be comma-separated integers")
+    # A negative index would turn into a negative seek and cache frame 0 under the wrong name
+    if indices and indices[0] < 0: raise HTTPException(status_code=400, detail="frames must be non-negative")
+    clip_file = INPUTS_DIR / video_id / "TrimmedClips" / f"{clip_id}.mp4"
+    if not clip_file.exists(): raise HTTPException(status_code=404, detail="Source clip not found")
+    frames_dir = OUTPUTS_DIR / video_id / "frames"
+    ensure_dir(frames_dir)
+
+    missing = [n for n in indices if not (frames_dir / f"{clip_id}_f{n}.jpg").exists()]
+    if missing:
+        # Input-seek to just before the first missing frame (same half-frame aim as FrameExtractor), after
+        # which ffmpeg numbers decoded frames from 0 again
+        fps = probe_fps(clip_file)
+        first = missing[0] if fps else 0
+        seek = ["-ss", f"{(first - 0.5) / fps:.6f}"] if first else []
+        # One ffmpeg for the whole batch; selected frames come out in ascending n order
+        select_expr = "+".join(f"eq(n\\,{n - first})" for n in missing)
+        with tempfile.TemporaryDirectory(dir=frames_dir) as tmp:
+            subprocess.run(["ffmpeg", "-y", *seek, "-i", str(clip_file), "-vf", f"select={select_expr}", "-vsync", "0", "-q:v", "2", os.path.join(tmp, "%d.jpg")], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            for i, n in enumerate(missing, start=1):
+                extracted = Path(tmp) / f"{i}.jpg"
+                if extracted.exists(): os.replace(extracted, frames_dir / f"{clip_id}_f{n}.jpg")
+
+    return {"urls": [f"/outputs/{video_id}/frames/{clip_id}_f{n}.jpg" for n in indices]}
+
+# Per mask with a write in flight: the newest payload not yet on disk (None = reset) and the future that every
+# request whose data it carries awaits. Later saves/resets replace the payload, so only the newest one is written
+MASK_PENDING: Dict[Path, Dict] = {}
+
+async def write_mask(mask_path: Path, payload: Optional[bytes]):
+    if payload is None: await run_in_threadpool(mask_path.unlink, True)
+    else:
+        async with aiofiles.open(mask_path, "wb") as f: await f.write(payload)
+
+async def drain_mask_writes(mask_path: Path, state: Dict):
+    try:
+        while state["done"]:
+            done, payload = state["done"], state["payload"]
+            state["done"] = None
+            try:
+                await write_mask(mask_path, payload)
+                done.set_result(None)
+            except Exception as e: done.set_exception(e)
+    finally: MASK_PENDING.pop(mask_path, None)
+
+async def queue_mask_write(mask_path: Path, payload: Optional[bytes]):
+    state = MASK_PENDING.get(mask_path)
+    if not state:
+        state = MASK_PENDING[mask_path] = {"payload": None, "done": None}
+        # Runs as its own task so a disconnecting client can't strand the requests coalesced behind it
+        asyncio.create_task(drain_mask_writes(mask_path, state))
+    state["payload"] = payload
+    if state["done"] is None: state["done"] = asyncio.get_running_loop().create_future()
+    # Every caller gets the outcome of the write that carried its data (or superseded it)
+    await asyncio.shield(state["done"])
+
 @app.post("/mask/save/{video_id}/{clip_id}/{pass_num}")
 async def save_mask(video_id: str, clip_id: str, pass_num: int, data: Dict):
-    mask_path = get_mask_path(video_id, clip_id, pass_num)
-    with open(mask_path, "w") as f: json.dump(data, f, indent=2)
+    await queue_mask_write(get_mask_path(video_id, clip_id, pass_num), orjson.dumps(data))
     return {"status": "saved"}
 
 @app.get("/mask/load/{video_id}/{clip_id}/{pass_num}")
 def load_mask(video_id: str, clip_id: str, pass_num: int):
     mask_path = get_mask_path(video_id, clip_id, pass_num)
+    # The newest queued payload wins over a file that may still be mid-write
+    state = MASK_PENDING.get(mask_path)
+    if state:
+        if state["payload"] is None: raise HTTPException(status_code=404, detail="No saved mask")
+        return orjson.loads(state["payload"])
     if not mask_path.exists(): raise HTTPException(status_code=404, detail="No saved mask")
-    return json.load(open(mask_path, "r"))
+    with open(mask_path, "rb") as f: return orjson.loads(f.read())
 
 # FIX: Added Endpoint to reset (delete) the mask
 @app.post("/mask/reset/{video_id}/{clip_id}/{pass_num}")
-def reset_mask(video_id: str, clip_id: str, pass_num: int):
-    mask_path = get_mask_path(video_id, clip_id, pass_num)
-    if mask_path.exists():
-        mask_path.unlink()
+async def reset_mask(video_id: str, clip_id: str, pass_num: int):
+    # Queued like a save, so it drops any payload still waiting and can't be overwritten by a write in flight
+    await queue_mask_write(get_mask_path(video_id, clip_id, pass_num), None)
     return {"status": "reset"}
 
 @app.post("/character/upload/{character_name}")
 async def upload_character(character_name: str, file: UploadFile = File(...)):
     save_path = ASSETS_DIR / f"custom_{character_name}.png"
-    with open(save_path, "wb") as buffer: shutil.copyfileobj(file.file, buffer)
+    # Cloud assets may be symlinks into the repo; replace the link instead of writing through it
+    save_path.unlink(missing_ok=True)
+    copied = False
+    # Uploads past the parser's spool limit are already in a temp file; copy those in-kernel instead of through
+    # Python. A file object without a usable descriptor raises OSError (io.UnsupportedOperation) and falls through
+    if hasattr(os, "sendfile") and (file.size or 0) > MultiPartParser.spool_max_size:
+        try:
+            await asyncio.to_thread(sendfile_copy, file.file, save_path)
+            copied = True
+        except OSError: await file.seek(0)
+    # Everything else, in-memory spools included, goes through one buffered copy off the event loop
+    if not copied: await asyncio.to_thread(copy_upload, file.file, save_path)
+    get_character_image.cache_clear()
     return {"status": "uploaded", "url": f"/assets/custom_{character_name}.png?t={int(time.time())}"}
 
 @app.get("/characters/check")
-def check_characters(): return {"char1": (ASSETS_DIR / "custom_char1.png").exists(), "char2": (ASSETS_DIR / "custom_char2.png").exists()}
+def check_characters():
+    names = list_assets()
+    return {"char1": "custom_char1.png" in names, "char2": "custom_char2.png" in names}
 
 @app.post("/queue/clip/{video_id}")
 async def queue_single_clip(video_id: str, clip_data: Dict, token: str = Depends(get_api_key)):
-    JOB_QUEUE.put((video_id, [clip_data["clip_id"]]))
+    enqueue_job(video_id, [clip_data["clip_id"]])
     return {"status": "queued"}
 
-@app.post("/queue/all/{video_id}")
-async def queue_all_clips(video_id: str, token: str = Depends(get_api_key)):
-    json_path = get_job_profile_path(video_id)
-    with open(json_path, "r") as f: data = json.load(f)
+def find_queueable_clips(video_id: str):
+    data = read_job_profile(video_id)
     
     ids_to_queue = []
     missing_masks = []
+    # One readdir for every mask check below instead of a stat per clip/pass
+    try: saved_masks = {entry.name for entry in os.scandir(get_mask_dir(video_id))}
+    except FileNotFoundError: saved_masks = set()
     
     # FIX: Loop through clips to check if all necessary masks are saved
     for clip in data["clips"]:
@@ -297,62 +737,105 @@ async def queue_all_clips(video_id: str, token: str = Depends(get_api_key)):
         for action in clip.get("actions", []):
             pass_num = action["pass"]
             # If mask file doesn't exist, we can't queue it
-            if not get_mask_path(video_id, clip["clip_id"], pass_num).exists():
+            if f"{clip['clip_id']}_pass{pass_num}.json" not in saved_masks:
                 missing_masks.append(f"{clip['clip_id']} (Pass {pass_num})")
                 has_all_masks = False
                 
         if has_all_masks:
             ids_to_queue.append(clip["clip_id"])
-            
+    return ids_to_queue, missing_masks
+
+@app.post("/queue/all/{video_id}")
+async def queue_all_clips(video_id: str, token: str = Depends(get_api_key)):
+    # Profile read and mask listing touch the disk, so keep them off the event loop
+    ids_to_queue, missing_masks = await run_in_threadpool(find_queueable_clips, video_id)
     if missing_masks:
         return {"status": "error", "missing": missing_masks}
         
-    JOB_QUEUE.put((video_id, ids_to_queue))
+    enqueue_job(video_id, ids_to_queue)
     return {"status": "queued", "count": len(ids_to_queue)}
 
 @app.post("/stop")
-def stop_generation(token: str = Depends(get_api_key)):
-    stop_event.set()
-    while not JOB_QUEUE.empty():
-        try: JOB_QUEUE.get_nowait(); JOB_QUEUE.task_done()
-        except: pass
+async def stop_generation(token: str = Depends(get_api_key)):
+    for job_stop in list(job_stops): job_stop.set()
+    for job_queue in JOB_QUEUES:
+        while not job_queue.empty():
+            try: job_queue.get_nowait(); job_queue.task_done()
+            except: pass
+    set_status(queue_size=0)
     return {"status": "stopped"}
 
-@app.post("/reset/{video_id}")
-def reset_project(video_id: str, token: str = Depends(get_api_key)):
+def clear_outputs(video_id: str):
     out_dir = OUTPUTS_DIR / video_id
     if out_dir.exists():
-        for f in out_dir.glob("*.mp4"):
-            try: f.unlink()
-            except: pass
+        with os.scandir(out_dir) as entries:
+            for entry in entries:
+                # .part files are downloads cut off by a killed process (encodes already end in .part.mp4)
+                if not (entry.name.endswith((".mp4", ".part")) and entry.is_file()): continue
+                try: os.unlink(entry.path)
+                except: pass
+
+@app.post("/reset/{video_id}")
+async def reset_project(video_id: str, token: str = Depends(get_api_key)):
+    await run_media(clear_outputs, video_id)
     return {"status": "reset"}
 
-@app.post("/stitch/{video_id}")
-def stitch_video(video_id: str):
+def build_final_video(video_id: str):
     print(f"[STITCH] Starting for {video_id}", flush=True)
     out_dir = OUTPUTS_DIR / video_id
-    json_path = get_job_profile_path(video_id)
-    with open(json_path) as f: data = json.load(f)
+    data = read_job_profile(video_id)
     list_file = out_dir / "list.txt"
     final_video = out_dir / f"{video_id}_final.mp4"
     
-    with open(list_file, "w") as f:
-        for clip in data["clips"]:
-            clip_file = out_dir / f"{clip['clip_id']}.mp4"
-            if clip_file.exists(): f.write(f"file '{str(clip_file.resolve()).replace(os.sep, '/')}'\n")
-            else:
-                clean_name = Path(clip["path"]).name
-                source = INPUTS_DIR / video_id / "TrimmedClips" / clean_name
-                temp_conv = out_dir / f"temp_{clip['clip_id']}.mp4"
-                if not temp_conv.exists() and source.exists():
-                    subprocess.run(["ffmpeg", "-y", "-i", str(source), "-c:v", "libx264", "-pix_fmt", "yuv420p", "-r", str(data["fps"]), str(temp_conv)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                if temp_conv.exists(): f.write(f"file '{str(temp_conv.resolve()).replace(os.sep, '/')}'\n")
-
-    subprocess.run(["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", str(list_file), "-c", "copy", str(final_video)], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # One readdir per folder up front instead of stat calls per clip
+    outputs = {entry.name for entry in os.scandir(out_dir) if entry.is_file()} if out_dir.is_dir() else set()
+    trimmed_dir = INPUTS_DIR / video_id / "TrimmedClips"
+    sources = {entry.name: Path(entry.path) for entry in os.scandir(trimmed_dir) if entry.is_file()} if trimmed_dir.is_dir() else {}
+
+    entries, pending, canonical = [], [], None
+    for clip in data["clips"]:
+        clip_file = out_dir / f"{clip['clip_id']}.mp4"
+        if clip_file.name in outputs:
+            entries.append(clip_file)
+            canonical = canonical or probe_file(clip_file)
+            continue
+        source = sources.get(Path(clip["path"]).name)
+        temp_conv = out_dir / f"temp_{clip['clip_id']}.mp4"
+        if temp_conv.name not in outputs and source: pending.append((source, temp_conv))
+        entries.append(temp_conv)
+
+    # Each conversion and probe is a separate ffmpeg/ffprobe process, so run them side by side and keep list
+    # order afterwards
+    with ThreadPoolExecutor(max_workers=max(1, (os.cpu_count() or 2) // 2)) as pool:
+        size = canonical[1:3] if canonical else None
+        list(pool.map(lambda job: convert_clip(job[0], job[1], data["fps"], size), pending))
+
+        entries = [entry for entry in entries if entry.exists()]
+        # Stream-copy only when every input shares codec/size/fps/pix_fmt/SAR/profile; otherwise the output would be corrupt
+        streams = set(pool.map(probe_file, entries))
+
+    # Every entry sits in out_dir, so build the list from one absolute root instead of resolve() per file
+    out_root = os.path.abspath(out_dir).replace(os.sep, "/")
+    with open(list_file, "w") as f: f.write("".join(f"file '{out_root}/{entry.name}'\n" for entry in entries))
+
+    if len(streams) <= 1:
+        codec = ["-c", "copy"]
+    else:
+        width, height = (canonical or probe_file(entries[0]))[1:3]
+        codec = ["-vf", f"scale={width}:{height},setsar=1", *h264_encoder(), "-pix_fmt", "yuv420p", "-r", str(data["fps"])]
+    subprocess.run(["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", str(list_file), *codec, str(final_video)], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     return {"url": f"/outputs/{video_id}/{final_video.name}"}
 
+@app.post("/stitch/{video_id}")
+async def stitch_video(video_id: str): return await run_media(build_final_video, video_id)
+
+# Polled every second; an unchanged status revalidates to an empty 304 instead of resending the body
 @app.get("/status")
-def get_status(): return processing_status
+def get_status(if_none_match: Optional[str] = Header(None)):
+    body, etag = status_snapshot
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match == etag: return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
 
 @app.get("/")
 def health_check(): return {"status": "online", "mode": "Cloud" if IS_CLOUD else "Local"}
@@ -33,7 +33,8 @@ const ClipCard = React.memo(({ clip, openMaskModal, currentProject, status }) =>
   const inputUrl = `${API_BASE}/inputs/${relPath}`;
   const outputSrc = `${API_BASE}/outputs/${currentProject}/${clip.clip_id}.mp4`;
   
-  const isProcessing = status.current_clip === clip.clip_id;
+  const activePass = status.active_clips?.[currentProject]?.[clip.clip_id];
+  const isProcessing = activePass !== undefined;
   const [cacheBuster, setCacheBuster] = useState(Date.now());
 
   useEffect(() => {
@@ -51,7 +52,7 @@ const ClipCard = React.memo(({ clip, openMaskModal, currentProject, status }) =>
         {isProcessing ? (
           <span className="text-yellow-400 text-xs font-mono animate-pulse flex items-center gap-1">
              <div className="w-2 h-2 bg-yellow-400 rounded-full animate-ping"></div>
-             Pass {status.current_pass}
+             Pass {activePass}
           </span>
         ) : clip.status === "done" ? (
           <span className="text-green-400 text-xs flex items-center gap-1"><CheckCircle size={12}/> Done</span>
@@ -98,7 +99,7 @@ function App() {
   const [projects, setProjects] = useState([]);
   const [currentProject, setCurrentProject] = useState(null);
   const [jobData, setJobData] = useState(null);
-  const [status, setStatus] = useState({ is_processing: false, queue: [], last_completed: null });
+  const [status, setStatus] = useState({ is_processing: false, active_clips: {}, queue: [], last_completed: null });
   const [toast, setToast] = useState(null);
   
   const [token, setToken] = useState(localStorage.getItem("dfs_token") || "");
@@ -139,9 +140,9 @@ function App() {
   }, [currentProject, isAuthenticated]);
 
   const fetchStatusAndProject = async () => {
-    const timestamp = Date.now();
     try {
-      const res = await axios.get(`${API_BASE}/status`, { params: { t: timestamp } });
+      // No cache-buster: /status answers with an ETag, so the browser revalidates and gets a 304 when unchanged
+      const res = await axios.get(`${API_BASE}/status`);
       const newStatus = res.data;
       setStatus(prev => {
         if (JSON.stringify(prev) !== JSON.stringify(newStatus)) return newStatus;
@@ -217,8 +218,7 @@ function App() {
 
   const loadFrame = async (clip, index) => {
     setFrameUrl(null); 
-    const res = await axios.get(`${API_BASE}/frame/${currentProject}/${clip.clip_id}?frame=${index}`);
-    setFrameUrl(`${API_BASE}${res.data.url}?t=${Date.now()}`);
+    setFrameUrl(`${API_BASE}/frame/${currentProject}/${clip.clip_id}/image?frame=${index}`);
   };
 
   const loadMaskForPass = async (clip, pass) => {